@@ -1,55 +1,324 @@
-from http.server import BaseHTTPRequestHandler
+import asyncio
 import json
+import os
+
+# 在导入 librosa 之前开启其内置磁盘缓存（Vercel 上仅 /tmp 可写）
+# 级别 10 只缓存滤波器组；更高级别会把每个请求的中间数组也哈希并写入磁盘
+os.environ.setdefault('LIBROSA_CACHE_DIR', '/tmp/lrcache')
+os.environ.setdefault('LIBROSA_CACHE_LEVEL', '10')
+os.environ.setdefault('NUMBA_CACHE_DIR', '/tmp/numba_cache')
+
 import numpy as np
+import scipy.fft
+import scipy.signal
 import librosa
-import base64
+from numba import njit
+import binascii
+import hashlib
 import tempfile
-import os
+import io
+import threading
+import types
+from functools import lru_cache
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import soundfile as sf
+
+# 优先使用 C 实现的 orjson 做 JSON 编解码，不可用时退回标准库
+# _dumps 统一返回 UTF-8 字节，可直接作为响应体发送
+try:
+    import orjson
+
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    _loads = json.loads
+
+# 分析统一使用的采样率与最大时长（秒）
+# 11025 Hz 的奈奎斯特频率已覆盖调性和节奏所需的频段
+TARGET_SR = 11025
+MAX_DURATION = 20
+# 超过阈值的长音频只分析中间一段，调性和节奏在短片段上已足够稳定
+EXCERPT_THRESHOLD = 10
+EXCERPT_DURATION = 5.0
+# 调性检测需要半音级的频率分辨率，使用更长的窗（频点间隔约 1.3 Hz）
+KEY_N_FFT = 8192
+KEY_HOP_LENGTH = 2048
+# 调性轮廓覆盖的 MIDI 音高范围：C2–B6 整五个八度，每个音级的频带数相同
+KEY_MIN_MIDI = 36
+KEY_MAX_MIDI = 95
+# 节奏检测的 STFT 参数；随采样率减半，保持相同的时间/频率分辨率
+N_FFT = 1024
+HOP_LENGTH = 256
+# 节奏检测的 BPM 搜索范围
+MIN_BPM = 60
+MAX_BPM = 200
+# 与 librosa.beat.tempo 相同的对数正态先验，避免选到倍频/分频
+START_BPM = 120.0
+# 按音频内容哈希缓存的分析结果条数
+ANALYSIS_CACHE_SIZE = 256
+
+# onset 与 chroma 的计算都在释放 GIL 的原生内核中完成，用线程并行
+_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# base64 字母表（允许空白字符，与 b64decode 默认忽略空白的行为一致）
+_B64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=\r\n \t'
+
+# 各调性对应的基础和弦进行，只读且只构建一次
+CHORD_PROGRESSIONS = types.MappingProxyType({
+    'C': ('C', 'G', 'Am', 'F'),
+    'G': ('G', 'D', 'Em', 'C'),
+    'D': ('D', 'A', 'Bm', 'G'),
+    'A': ('A', 'E', 'F#m', 'D'),
+    'E': ('E', 'B', 'C#m', 'A'),
+    'F': ('F', 'C', 'Dm', 'Bb'),
+    'Am': ('Am', 'G', 'C', 'F')
+})
+DEFAULT_PROGRESSION = CHORD_PROGRESSIONS['C']
+
+
+@lru_cache(maxsize=None)
+def _hann_window(n_fft):
+    """与 librosa.stft 相同的周期 Hann 窗，每种长度只构建一次"""
+    return scipy.signal.get_window('hann', n_fft).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def _semitone_bands(sr, n_fft=KEY_N_FFT):
+    """KEY_MIN_MIDI–KEY_MAX_MIDI 每个半音对应的 FFT 频点区间、音级（0 为 C）和权重"""
+    midi = np.arange(KEY_MIN_MIDI, KEY_MAX_MIDI + 1)
+    centers = 440.0 * 2.0 ** ((midi - 69) / 12.0)
+    freqs = np.arange(n_fft // 2 + 1) * sr / n_fft
+    starts = np.searchsorted(freqs, centers * 2.0 ** (-1 / 24))
+    stops = np.maximum(np.searchsorted(freqs, centers * 2.0 ** (1 / 24)), starts + 1)
+    # 与 chroma_cqt 的恒 Q 滤波器一致，正弦分量的响应随频率按 f^-0.5 衰减
+    weights = centers ** -0.5
+    # 低频频带只有一两个频点，按理论带宽与实际频点数之比补偿，避免取整造成的音级偏差
+    ideal_bins = centers * (2.0 ** (1 / 24) - 2.0 ** (-1 / 24)) * n_fft / sr
+    weights *= np.sqrt(ideal_bins / (stops - starts))
+    return starts, stops, midi % 12, weights
+
+
+@njit(cache=True, nogil=True)
+def _chroma_profile(S, starts, stops, pitch_classes, weights):
+    """把功率谱按半音频带汇总成 12 维音级轮廓，每帧先按最大值归一化（同 chroma 的 norm=inf）
+
+    每个频带取能量的平方根再乘以权重：正弦分量与频带宽度无关，
+    宽带噪声在各音级间保持平衡，不会因高频频带更宽而偏向某个音级
+    """
+    acc = np.zeros(12)
+    frame = np.zeros(12)
+    for t in range(S.shape[1]):
+        frame[:] = 0.0
+        for b in range(starts.size):
+            energy = 0.0
+            for k in range(starts[b], stops[b]):
+                energy += S[k, t]
+            frame[pitch_classes[b]] += weights[b] * np.sqrt(energy)
+        peak = frame.max()
+        if peak > 0:
+            for pc in range(12):
+                acc[pc] += frame[pc] / peak
+    return acc
+
+
+@njit(cache=True, fastmath=True)
+def _autocorr_tempo(onset_env, sr, hop_length, min_bpm, max_bpm, start_bpm):
+    """对 onset 包络做自相关，按对数正态先验在 BPM 范围内取峰值；没有正的得分（如静音）时返回先验中心"""
+    n = onset_env.size
+    max_lag = min(4 * sr // hop_length, n)
+    best_tempo = start_bpm
+    best_score = 0.0
+    for lag in range(1, max_lag):
+        tempo = 60.0 * sr / (hop_length * lag)
+        if tempo < min_bpm or tempo > max_bpm:
+            continue
+        acc = 0.0
+        for i in range(n - lag):
+            acc += onset_env[i] * onset_env[i + lag]
+        score = acc * np.exp(-0.5 * np.log2(tempo / start_bpm) ** 2)
+        if score > best_score:
+            best_score = score
+            best_tempo = tempo
+    return best_tempo
+
+
+def decode_base64(audio_b64):
+    """先删去所有合法字符，有剩余即为非法输入，在解码前快速失败"""
+    raw = audio_b64.encode('ascii') if isinstance(audio_b64, str) else audio_b64
+    if raw.translate(None, _B64_ALPHABET):
+        raise ValueError('Invalid base64 data')
+    return binascii.a2b_base64(raw)
+
+
+def _load_audio_file(audio_bytes, sr, duration):
+    """libsndfile 不支持的格式（如 m4a），写入临时文件交给 librosa 的 audioread 后端解码"""
+    with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+        tmp_file.write(audio_bytes)
+        tmp_path = tmp_file.name
+
+    try:
+        return librosa.load(tmp_path, sr=sr, mono=True, duration=duration,
+                            res_type='polyphase', dtype=np.float32)
+    finally:
+        os.unlink(tmp_path)
+
+
+def load_audio(audio_bytes, sr=TARGET_SR, duration=MAX_DURATION):
+    """优先直接在内存中解码音频，转为单声道并重采样"""
+    try:
+        with sf.SoundFile(io.BytesIO(audio_bytes)) as f:
+            orig_sr = f.samplerate
+            audio_data = f.read(frames=int(orig_sr * duration), dtype='float32', always_2d=False)
+    except sf.LibsndfileError:
+        return _load_audio_file(audio_bytes, sr, duration)
+
+    if audio_data.ndim > 1:
+        audio_data = audio_data.mean(axis=1)
+
+    if orig_sr != sr:
+        audio_data = librosa.resample(audio_data, orig_sr=orig_sr, target_sr=sr, res_type='polyphase')
+
+    return audio_data, sr
+
+
+def select_excerpt(audio_data, sr):
+    """长音频截取中间的 EXCERPT_DURATION 秒，短音频原样返回"""
+    if len(audio_data) / sr <= EXCERPT_THRESHOLD:
+        return audio_data
+
+    center = len(audio_data) // 2
+    half = int(EXCERPT_DURATION * sr / 2)
+    return audio_data[center - half:center + half]
+
+
+def power_spectrogram(audio_data, n_fft=N_FFT, hop_length=HOP_LENGTH):
+    """分帧后直接做 rfft 的功率谱，结果与 librosa.stft(center=True) 一致，但省去其封装开销"""
+    padded = np.pad(audio_data, n_fft // 2)
+    frames = np.lib.stride_tricks.sliding_window_view(padded, n_fft)[::hop_length]
+    return (np.abs(scipy.fft.rfft(frames * _hann_window(n_fft), axis=1)) ** 2).T
 
 
 class SimpleMusicProcessor:
-    def detect_tempo(self, audio_data, sr):
+    def extract_features(self, audio_data, sr):
+        """一次提取节奏用的 onset 包络和调性用的 chroma，onset 在工作线程中并行计算"""
+        # 全程使用 float32，STFT 与 chroma 的内存带宽减半
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        onset_future = _EXECUTOR.submit(self._onset_envelope, audio_data, sr)
+        # 调性需要半音级的频率分辨率，不能与节奏共用短窗 STFT，单独计算长窗频谱
+        S_key = power_spectrogram(audio_data, KEY_N_FFT, KEY_HOP_LENGTH)
+        # 只需要 12 个音级的总能量，用自定义内核代替 librosa 的 chroma 流程
+        chroma = _chroma_profile(S_key, *_semitone_bands(sr))
+        return onset_future.result(), chroma
+
+    def _onset_envelope(self, audio_data, sr):
+        S = power_spectrogram(audio_data)
+        # onset_strength 需要对数功率的 mel 谱，先把线性功率谱投影到 mel 频带
+        mel = librosa.feature.melspectrogram(S=S, sr=sr, n_fft=N_FFT)
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr, hop_length=HOP_LENGTH)
+        return onset_env.astype(np.float32, copy=False)
+
+    def detect_tempo(self, onset_env, sr):
         """简化的节奏检测"""
-        try:
-            # 使用更简单的节奏检测方法
-            onset_env = librosa.onset.onset_strength(y=audio_data, sr=sr, hop_length=512)
-            tempo = librosa.beat.tempo(onset_envelope=onset_env, sr=sr)[0]
-            return float(tempo)
-        except Exception as e:
-            print(f"Tempo detection error: {e}")
-            return 120.0
+        # 直接对 onset 包络做自相关取峰值，无需完整的节拍跟踪
+        tempo = _autocorr_tempo(onset_env, sr, HOP_LENGTH, MIN_BPM, MAX_BPM, START_BPM)
+        return float(tempo)
 
-    def detect_key(self, audio_data, sr):
+    def detect_key(self, chroma):
         """简化的调性检测"""
+        major_keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+        # 内核已按帧累加出 12 维轮廓，直接取最大的音级
+        key_index = int(np.argmax(chroma))
+
+        return major_keys[key_index]
+
+    def analyze(self, audio_data, sr):
+        """一次特征提取，返回 (tempo, key, fell_back)；任一环节出错时退回默认值并将 fell_back 置为 True"""
         try:
-            # 使用更稳定的 chroma 特征提取
-            chroma = librosa.feature.chroma_cqt(y=audio_data, sr=sr)
-            chroma_avg = np.mean(chroma, axis=1)
+            onset_env, chroma = self.extract_features(audio_data, sr)
+        except Exception as e:
+            print(f"Feature extraction error: {e}")
+            return 120.0, 'C', True
 
-            major_keys = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
-            key_index = np.argmax(chroma_avg)
+        fell_back = False
+        try:
+            tempo = self.detect_tempo(onset_env, sr)
+        except Exception as e:
+            print(f"Tempo detection error: {e}")
+            tempo, fell_back = 120.0, True
 
-            return major_keys[key_index]
+        try:
+            key = self.detect_key(chroma)
         except Exception as e:
             print(f"Key detection error: {e}")
-            return 'C'
+            key, fell_back = 'C', True
+
+        return tempo, key, fell_back
 
     def generate_chords(self, key, tempo):
         """生成基础和弦"""
-        chord_progressions = {
-            'C': ['C', 'G', 'Am', 'F'],
-            'G': ['G', 'D', 'Em', 'C'],
-            'D': ['D', 'A', 'Bm', 'G'],
-            'A': ['A', 'E', 'F#m', 'D'],
-            'E': ['E', 'B', 'C#m', 'A'],
-            'F': ['F', 'C', 'Dm', 'Bb'],
-            'Am': ['Am', 'G', 'C', 'F']
-        }
-        return chord_progressions.get(key, ['C', 'G', 'Am', 'F'])
+        return list(CHORD_PROGRESSIONS.get(key, DEFAULT_PROGRESSION))
+
 
+# 处理器无状态，在同一容器的多次请求间复用
+_PROCESSOR = SimpleMusicProcessor()
 
-def handler(req, context):
-    """Vercel Serverless Function 处理函数"""
+
+def _warmup():
+    """导入时用一秒静音跑一遍分析流程，预先构建滤波器组并完成 numba 的 JIT 编译，
+    避免首个请求承担初始化开销"""
+    try:
+        silence = np.zeros(TARGET_SR, dtype=np.float32)
+        onset_env, chroma = _PROCESSOR.extract_features(silence, TARGET_SR)
+        _PROCESSOR.detect_tempo(onset_env, TARGET_SR)
+        _PROCESSOR.detect_key(chroma)
+    except Exception as e:
+        print(f"Warmup error: {e}")
+
+
+_warmup()
+
+# 分析结果只取决于音频内容，按 BLAKE2b 摘要做进程内 LRU 缓存
+_ANALYSIS_CACHE = OrderedDict()
+_ANALYSIS_CACHE_LOCK = threading.Lock()
+
+
+def analyze_audio(audio_bytes):
+    """解码并分析音频，返回 (tempo, key, chords, analyzed_seconds)，相同内容直接命中缓存"""
+    digest = hashlib.blake2b(audio_bytes, digest_size=16).digest()
+    with _ANALYSIS_CACHE_LOCK:
+        cached = _ANALYSIS_CACHE.get(digest)
+        if cached is not None:
+            _ANALYSIS_CACHE.move_to_end(digest)
+    if cached is not None:
+        tempo, key, chords, analyzed_seconds = cached
+        return tempo, key, list(chords), analyzed_seconds
+
+    # 在内存中解码音频，限制时长和采样率以减少内存使用
+    audio_data, sr = load_audio(audio_bytes)
+    audio_data = select_excerpt(audio_data, sr)
+
+    tempo, key, fell_back = _PROCESSOR.analyze(audio_data, sr)
+    chords = _PROCESSOR.generate_chords(key, tempo)
+    analyzed_seconds = round(len(audio_data) / sr, 2)
+
+    # 退回默认值的结果可能只是暂时性故障，不写入缓存
+    if fell_back:
+        return tempo, key, chords, analyzed_seconds
+
+    with _ANALYSIS_CACHE_LOCK:
+        _ANALYSIS_CACHE[digest] = (tempo, key, tuple(chords), analyzed_seconds)
+        if len(_ANALYSIS_CACHE) > ANALYSIS_CACHE_SIZE:
+            _ANALYSIS_CACHE.popitem(last=False)
+
+    return tempo, key, chords, analyzed_seconds
+
+
+def _handle(req):
+    """处理单个请求，返回 statusCode/headers/body 字典（body 为已序列化的字节）；由 ASGI 入口 app 调用"""
     try:
         if req.method == 'OPTIONS':
             return {
@@ -68,7 +337,7 @@ def handler(req, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': _dumps({
                     'success': True,
                     'message': 'AI Music API is running!',
                     'endpoints': {
@@ -80,8 +349,8 @@ def handler(req, context):
         elif req.method == 'POST':
             # 解析请求体
             body = req.body
-            if isinstance(body, str):
-                data = json.loads(body)
+            if isinstance(body, (str, bytes)):
+                data = _loads(body)
             else:
                 data = body
 
@@ -94,7 +363,7 @@ def handler(req, context):
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({
+                    'body': _dumps({
                         'success': False,
                         'error': 'No audio data provided'
                     })
@@ -102,7 +371,7 @@ def handler(req, context):
 
             # 解码音频
             try:
-                audio_bytes = base64.b64decode(audio_b64)
+                audio_bytes = decode_base64(audio_b64)
             except:
                 return {
                     'statusCode': 400,
@@ -110,31 +379,21 @@ def handler(req, context):
                         'Content-Type': 'application/json',
                         'Access-Control-Allow-Origin': '*'
                     },
-                    'body': json.dumps({
+                    'body': _dumps({
                         'success': False,
                         'error': 'Invalid audio data format'
                     })
                 }
 
-            # 使用临时文件处理音频
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
-                tmp_file.write(audio_bytes)
-                tmp_path = tmp_file.name
-
             try:
-                # 加载音频文件，限制时长和采样率以减少内存使用
-                audio_data, sr = librosa.load(tmp_path, sr=22050, duration=20)
-
-                processor = SimpleMusicProcessor()
-                tempo = processor.detect_tempo(audio_data, sr)
-                key = processor.detect_key(audio_data, sr)
-                chords = processor.generate_chords(key, tempo)
+                tempo, key, chords, analyzed_seconds = analyze_audio(audio_bytes)
 
                 response = {
                     'success': True,
                     'tempo': tempo,
                     'key': key,
                     'chords': chords,
+                    'analyzed_seconds': analyzed_seconds,
                     'message': '音乐处理成功！'
                 }
 
@@ -144,18 +403,13 @@ def handler(req, context):
                     'error': f'Audio processing error: {str(audio_error)}'
                 }
 
-            finally:
-                # 清理临时文件
-                if os.path.exists(tmp_path):
-                    os.unlink(tmp_path)
-
             return {
                 'statusCode': 200,
                 'headers': {
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps(response)
+                'body': _dumps(response)
             }
 
         else:
@@ -165,7 +419,7 @@ def handler(req, context):
                     'Content-Type': 'application/json',
                     'Access-Control-Allow-Origin': '*'
                 },
-                'body': json.dumps({
+                'body': _dumps({
                     'success': False,
                     'error': 'Method not allowed'
                 })
@@ -178,18 +432,40 @@ def handler(req, context):
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
-            'body': json.dumps({
+            'body': _dumps({
                 'success': False,
                 'error': f'Server error: {str(e)}'
             })
         }
 
 
-# 为了兼容性，保留旧的 handler 类
-class Handler(BaseHTTPRequestHandler):
-    def do_OPTIONS(self):
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        self.end_headers()
\ No newline at end of file
+async def app(scope, receive, send):
+    """ASGI 入口（Vercel Python 运行时的唯一入口）：异步读取请求体，音频分析放到工作线程执行，不阻塞事件循环"""
+    if scope['type'] != 'http':
+        return
+
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+
+    req = types.SimpleNamespace(method=scope['method'], body=b''.join(chunks))
+    result = await asyncio.to_thread(_handle, req)
+
+    # 响应体在 _handle 中已序列化为字节，直接带上 Content-Length，便于连接复用
+    body = result.get('body', b'')
+    # ASGI 规定响应头名称必须为小写
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in result['headers'].items()]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+
+    await send({
+        'type': 'http.response.start',
+        'status': result['statusCode'],
+        'headers': headers
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': body
+    })
\ No newline at end of file
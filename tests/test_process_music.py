@@ -0,0 +1,230 @@
+import asyncio
+import base64
+import importlib.util
+import io
+import json
+import os
+import sys
+import tempfile
+import types
+
+# numba 缓存记录了加载时的模块名，测试使用独立目录，避免与部署环境的缓存互相干扰
+os.environ['NUMBA_CACHE_DIR'] = tempfile.mkdtemp(prefix='numba-test-')
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import librosa
+
+MODULE_PATH = os.path.join(os.path.dirname(__file__), '..', 'api', 'process-music.py')
+
+
+@pytest.fixture(scope='module')
+def pm():
+    # 文件名带连字符，无法直接 import，按路径加载
+    spec = importlib.util.spec_from_file_location('process_music', MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['process_music'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def to_wav(y, sr=22050):
+    bio = io.BytesIO()
+    sf.write(bio, y, sr, format='WAV')
+    return bio.getvalue()
+
+
+def analyze(pm, wav):
+    return pm.analyze_audio(wav)[:2]
+
+
+def post(pm, wav):
+    req = types.SimpleNamespace(method='POST', body=json.dumps({'audioData': base64.b64encode(wav).decode('ascii')}))
+    result = pm._handle(req)
+    return result['statusCode'], json.loads(result['body'])
+
+
+def tone(freq, sr=22050, duration=5.0):
+    t = np.arange(int(sr * duration)) / sr
+    return (0.2 * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def test_load_audio_downmixes_and_limits_duration(pm):
+    stereo = np.stack([tone(440.0, 44100, 25.0), tone(220.0, 44100, 25.0)], axis=1)
+    audio_data, sr = pm.load_audio(to_wav(stereo, 44100))
+    assert sr == pm.TARGET_SR
+    assert audio_data.ndim == 1
+    assert audio_data.dtype == np.float32
+    assert audio_data.size == pm.TARGET_SR * pm.MAX_DURATION
+
+
+def test_load_audio_falls_back_for_unsupported_formats(pm, monkeypatch):
+    wav = to_wav(tone(261.63))
+    expected, _ = pm.load_audio(wav)
+
+    class FileOnlySoundFile(sf.SoundFile):
+        def __init__(self, file, *args, **kwargs):
+            if not isinstance(file, (str, os.PathLike)):
+                raise sf.LibsndfileError(0, 'Format not recognised.')
+            super().__init__(file, *args, **kwargs)
+
+    monkeypatch.setattr(sf, 'SoundFile', FileOnlySoundFile)
+    audio_data, sr = pm.load_audio(wav)
+    assert sr == pm.TARGET_SR
+    np.testing.assert_allclose(audio_data, expected, atol=1e-6)
+
+
+def click_track(bpm, sr=22050, duration=8.0):
+    rng = np.random.default_rng(bpm)
+    t = np.arange(int(sr * duration)) / sr
+    y = librosa.clicks(times=np.arange(0.1, duration, 60.0 / bpm), sr=sr, length=t.size)
+    y += 0.3 * np.sin(2 * np.pi * 261.63 * t) + 0.02 * rng.standard_normal(t.size)
+    return y.astype(np.float32)
+
+
+@pytest.mark.parametrize('bpm', [70, 80, 100, 130, 160])
+def test_click_track_tempo(pm, bpm):
+    tempo, _ = analyze(pm, to_wav(click_track(bpm)))
+    assert tempo == pytest.approx(bpm, rel=0.04)
+
+
+@pytest.mark.parametrize('duration', [2, 5, 8])
+def test_silence_tempo_is_prior_centre(pm, duration):
+    tempo, _ = analyze(pm, to_wav(np.zeros(22050 * duration, dtype=np.float32)))
+    assert tempo == pm.START_BPM
+
+
+def test_select_excerpt_keeps_the_centre_of_long_clips(pm):
+    sr = pm.TARGET_SR
+    audio_data = np.arange(12 * sr, dtype=np.float32)
+    excerpt = pm.select_excerpt(audio_data, sr)
+    assert excerpt.size == pytest.approx(pm.EXCERPT_DURATION * sr, abs=1)
+    assert excerpt[0] + excerpt[-1] == pytest.approx(audio_data.size - 1, abs=2)
+
+
+def test_select_excerpt_leaves_clips_up_to_the_threshold(pm):
+    sr = pm.TARGET_SR
+    audio_data = np.zeros(int(pm.EXCERPT_THRESHOLD * sr), dtype=np.float32)
+    assert pm.select_excerpt(audio_data, sr) is audio_data
+
+
+@pytest.mark.parametrize('duration,analyzed_seconds', [(10.0, 10.0), (12.0, 5.0)])
+def test_post_reports_analyzed_seconds(pm, duration, analyzed_seconds):
+    status, body = post(pm, to_wav(click_track(120, duration=duration)))
+    assert status == 200
+    assert body['success']
+    assert body['analyzed_seconds'] == pytest.approx(analyzed_seconds, abs=0.01)
+
+
+KEY_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def major_triad(root, sr=22050, duration=5.0, harmonics=1):
+    t = np.arange(int(sr * duration)) / sr
+    y = np.zeros_like(t)
+    for interval in (0, 4, 7):
+        freq = 261.63 * 2 ** ((root + interval) / 12)
+        for h in range(1, harmonics + 1):
+            y += np.sin(2 * np.pi * freq * h * t) / h
+    return (0.2 * y / np.abs(y).max()).astype(np.float32)
+
+
+@pytest.mark.parametrize('root', range(12))
+def test_pure_major_triad_key(pm, root):
+    _, key = analyze(pm, to_wav(major_triad(root)))
+    assert key == KEY_NAMES[root]
+
+
+@pytest.mark.parametrize('root', [0, 5, 9])
+def test_harmonic_major_triad_key(pm, root):
+    _, key = analyze(pm, to_wav(major_triad(root, harmonics=5)))
+    assert key == KEY_NAMES[root]
+
+
+def test_white_noise_has_no_key_bias(pm):
+    rng = np.random.default_rng(0)
+    keys = {analyze(pm, to_wav((0.1 * rng.standard_normal(22050 * 5)).astype(np.float32)))[1]
+            for _ in range(12)}
+    assert len(keys) >= 5
+
+
+def call_app(pm, method, body=b''):
+    messages = iter([{'type': 'http.request', 'body': body, 'more_body': False}])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(pm.app({'type': 'http', 'method': method, 'path': '/'}, receive, send))
+    return sent
+
+
+def test_app_is_the_only_entry_point(pm):
+    # @vercel/python 会优先使用模块级的 handler/Handler，它们存在时 app 不会被调用
+    assert not hasattr(pm, 'handler')
+    assert not hasattr(pm, 'Handler')
+
+
+@pytest.mark.parametrize('method,body,status', [
+    ('OPTIONS', b'', 200),
+    ('GET', b'', 200),
+    ('POST', b'{}', 400),
+    ('PUT', b'', 405),
+])
+def test_app_sends_lowercase_headers(pm, method, body, status):
+    start, _ = call_app(pm, method, body)
+    assert start['status'] == status
+    assert all(name == name.lower() for name, _ in start['headers'])
+
+
+@pytest.mark.parametrize('method,body', [
+    ('OPTIONS', b''),
+    ('GET', b''),
+    ('POST', b'{}'),
+    ('PUT', b''),
+])
+def test_app_sends_content_length(pm, method, body):
+    start, message = call_app(pm, method, body)
+    headers = dict(start['headers'])
+    assert int(headers[b'content-length']) == len(message['body'])
+
+
+def test_fallback_result_is_not_cached(pm, monkeypatch):
+    wav = to_wav(major_triad(9))
+    pm._ANALYSIS_CACHE.clear()
+    extract_features = pm.SimpleMusicProcessor.extract_features
+
+    def failing(self, audio_data, sr):
+        raise RuntimeError('transient failure')
+
+    monkeypatch.setattr(pm.SimpleMusicProcessor, 'extract_features', failing)
+    assert pm.analyze_audio(wav)[:2] == (120.0, 'C')
+
+    monkeypatch.setattr(pm.SimpleMusicProcessor, 'extract_features', extract_features)
+    assert pm.analyze_audio(wav)[1] == 'A'
+
+
+def test_decode_base64_allows_whitespace(pm):
+    data = bytes(range(256)) * 4
+    encoded = base64.b64encode(data).decode('ascii')
+    folded = '\r\n'.join(' \t' + encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    assert pm.decode_base64(folded) == data
+    with pytest.raises(ValueError):
+        pm.decode_base64(encoded[:-4] + '!' + encoded[-3:])
+
+
+@pytest.mark.parametrize('n_fft,hop_length', [(1024, 256), (8192, 2048)])
+@pytest.mark.parametrize('length', [500, 3000, 11025 * 2])
+# 参考实现在输入短于一帧时会发出警告，这里正是要覆盖的情形
+@pytest.mark.filterwarnings('ignore:n_fft=.*is too large')
+def test_power_spectrogram_matches_librosa_stft(pm, n_fft, hop_length, length):
+    y = (0.1 * np.random.default_rng(length).standard_normal(length)).astype(np.float32)
+    expected = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length)) ** 2
+    S = pm.power_spectrogram(y, n_fft, hop_length)
+    assert S.shape == expected.shape
+    np.testing.assert_allclose(S, expected, rtol=1e-4, atol=1e-6 * expected.max())